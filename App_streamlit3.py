@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, time as dtime
 import pytz
 import os
 import time
@@ -12,8 +12,10 @@ from urllib.parse import quote
 # 1. IMPORTACIONES
 # =============================================================================
 from Routing_logic3 import (
-    COORDENADAS_LOTES, solve_route_optimization, VEHICLES, COORDENADAS_ORIGEN,
-    generate_geojson_io_link, generate_geojson, COORDENADAS_LOTES_REVERSO
+    COORDENADAS_LOTES, solve_route_optimization, solve_routes_for_grouping, VEHICLES, COORDENADAS_ORIGEN,
+    generate_geojson_io_link, generate_geojson, COORDENADAS_LOTES_REVERSO, parse_lotes_input, MAX_LOTES_POR_PATRON,
+    CARGA_LOTES, TIEMPO_SERVICIO_LOTES, VENTANAS_LOTES, CARGA_POR_DEFECTO, TIEMPO_SERVICIO_POR_DEFECTO,
+    CAPACIDAD_POR_DEFECTO, HORA_INICIO_JORNADA, HORA_FIN_JORNADA, FACTOR_RECORRIDO, VELOCIDAD_MEDIA_KMH
 )
 
 # =============================================================================
@@ -84,28 +86,92 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-COLUMNS = ["Fecha", "Hora", "LotesIngresados", "Lotes_CamionA", "Lotes_CamionB", "Km_CamionA", "Km_CamionB", "Km Totales"]
+COLUMNS = ["Fecha", "Hora", "LotesIngresados", "Lotes_CamionA", "Lotes_CamionB", "Km_CamionA", "Km_CamionB", "Km Totales", "Km_Estimados"]
 
 # =============================================================================
 # 3. FUNCIONES AUXILIARES
 # =============================================================================
 
+@st.cache_resource
+def get_catalogo_lotes():
+    """Catálogo de lotes como DataFrame indexado por código (lon, lat)"""
+    return pd.DataFrame.from_dict(COORDENADAS_LOTES, orient='index', columns=['lon', 'lat'])
+
+@st.cache_data
+def build_map_frame(valid_stops):
+    """Frame del mapa (Ingenio + lotes) construido en un solo paso sobre el catálogo"""
+    lotes = get_catalogo_lotes().loc[list(valid_stops), ['lat', 'lon']]
+    lotes = lotes.assign(name=lotes.index, color='#0044ff')
+    origen = pd.DataFrame([{'lat': COORDENADAS_ORIGEN[1], 'lon': COORDENADAS_ORIGEN[0], 'name': 'INGENIO', 'color': '#000000'}])
+    return pd.concat([origen, lotes], ignore_index=True)
+
 def generate_gmaps_link(stops_order_names):
     """Genera el link oficial de navegación de Google Maps"""
     if not stops_order_names: return '#'
     lat_orig, lon_orig = COORDENADAS_ORIGEN[1], COORDENADAS_ORIGEN[0]
     origin_str = f"{lat_orig},{lon_orig}"
     
-    waypoints = []
-    for lote_nombre in stops_order_names:
-        if lote_nombre in COORDENADAS_LOTES:
-            lon, lat = COORDENADAS_LOTES[lote_nombre]
-            waypoints.append(f"{lat},{lon}")
+    coords = get_catalogo_lotes().reindex(list(stops_order_names)).dropna()
+    waypoints = (coords['lat'].astype(str) + ',' + coords['lon'].astype(str)).tolist()
             
     base_url = "https://www.google.com/maps/dir/"
     route_path = "/".join([origin_str] + waypoints + [origin_str])
     return base_url + route_path
 
+def minutes_to_time(minutes):
+    return dtime(minutes // 60, minutes % 60) if minutes is not None else None
+
+def time_to_minutes(t):
+    return t.hour * 60 + t.minute if isinstance(t, dtime) else None
+
+def km_ruta(ruta):
+    """Km a registrar: los de la jornada por viajes si se planificó, si no los del recorrido único"""
+    jornada = ruta.get('jornada')
+    return jornada['distancia_estimada_km'] if jornada else ruta.get('distancia_km', 0)
+
+def lotes_ruta(ruta):
+    """Lotes a registrar: con viajes planificados, solo los que quedaron en algún viaje"""
+    jornada = ruta.get('jornada')
+    if not jornada:
+        return ruta.get('lotes_asignados', [])
+    return [l for v in jornada['viajes'] for l in v['lotes']]
+
+def render_jornada(ruta):
+    """Vista por viajes de un camión: tabla, navegación por viaje y ruta de referencia en un solo viaje"""
+    jornada = ruta['jornada']
+    kpi1, kpi2, kpi3 = st.columns(3)
+    kpi1.metric("Distancia est. (viajes)", f"{jornada['distancia_estimada_km']} km")
+    kpi2.metric("Lotes", len(ruta.get('lotes_asignados', [])))
+    kpi3.metric("Viajes", len(jornada['viajes']))
+
+    st.markdown(f"**Viajes de la jornada** (capacidad {jornada['capacidad']} t · fin {jornada['fin_jornada'] or '-'}):")
+    filas = [{
+        "Viaje": v['numero'],
+        "Salida": v['salida'],
+        "Lotes": " ➤ ".join(f"{l} ({h})" for l, h in zip(v['lotes'], v['llegadas'])),
+        "Carga (t)": v['carga'],
+        "Regreso": v['regreso'],
+    } for v in jornada['viajes']]
+    st.dataframe(pd.DataFrame(filas), use_container_width=True, hide_index=True)
+    for v in jornada['viajes']:
+        st.link_button(f"📍 Viaje {v['numero']} · salida {v['salida']} (Google Maps)", generate_gmaps_link(v['lotes']), type="primary", use_container_width=True)
+
+    st.caption(f"Horarios y distancias estimados: línea recta × {FACTOR_RECORRIDO} a {VELOCIDAD_MEDIA_KMH} km/h.")
+    if jornada['lotes_estimados']:
+        st.info(
+            f"ℹ️ {len(jornada['lotes_estimados'])} lotes sin carga o tiempo de servicio informados; se usaron los valores por defecto "
+            f"({CARGA_POR_DEFECTO} t, {TIEMPO_SERVICIO_POR_DEFECTO} min) y cargas/horarios son estimados: {', '.join(jornada['lotes_estimados'])}"
+        )
+    if jornada['no_asignados']:
+        st.warning(f"⚠️ Sin viaje factible (capacidad u horario): {', '.join(jornada['no_asignados'])}")
+
+    with st.expander("Ruta de referencia en un solo viaje (ignora capacidad y horarios)"):
+        st.metric("Distancia (un solo viaje)", f"{ruta.get('distancia_km',0)} km")
+        seq = " ➤ ".join(["Ingenio"] + ruta.get('orden_optimo', []) + ["Ingenio"])
+        st.code(seq, language="text")
+        st.link_button("📍 Ruta única (Google Maps)", generate_gmaps_link(ruta.get('orden_optimo', [])), type="secondary", use_container_width=True)
+        st.link_button("🌐 Ver Mapa Web (Visual)", ruta.get('geojson_link', '#'), type="secondary", use_container_width=True)
+
 # =============================================================================
 # 4. CONEXIÓN BASE DE DATOS
 # =============================================================================
@@ -137,7 +203,7 @@ def save_new_route_to_sheet(new_route_data):
         worksheet = sh.worksheet(st.secrets["SHEET_WORKSHEET"])
         row_values = [new_route_data.get(col, "") for col in COLUMNS]
         worksheet.append_row(row_values)
-        st.cache_data.clear()
+        get_history_data.clear()
     except Exception as e:
         st.error(f"Error registrando operación: {e}")
 
@@ -189,7 +255,7 @@ def calculate_statistics(df):
 # =============================================================================
 
 if 'historial_cargado' not in st.session_state:
-    st.cache_data.clear()
+    get_history_data.clear()
     df_hist = get_history_data()
     st.session_state.historial_rutas = df_hist.to_dict('records')
     st.session_state.historial_cargado = True
@@ -197,6 +263,11 @@ if 'historial_cargado' not in st.session_state:
 if 'results' not in st.session_state:
     st.session_state.results = None
 
+# La mejor división parcial solo sobrevive a la ejecución que acepta "Detener y aceptar actual";
+# cualquier otra interacción descarta la búsqueda interrumpida.
+if 'mejor_parcial' not in st.session_state or not st.session_state.get('aceptar_parcial'):
+    st.session_state.mejor_parcial = None
+
 with st.sidebar:
     st.image("https://raw.githubusercontent.com/mkzmh/Optimizator-historial/main/LOGO%20CN%20GRUPO%20COLOR%20(1).png", use_container_width=True)
     st.markdown("### Panel de Control")
@@ -214,11 +285,10 @@ if page == "Planificación Operativa":
     
     st.markdown("---")
     
-    lotes_input = st.text_input("Ingreso de Lotes", placeholder="Ingrese códigos separados por coma (Ej: A05, B10, C95)")
+    lotes_input = st.text_input("Ingreso de Lotes", placeholder="Ingrese códigos separados por coma (Ej: A05, B10, C95, A09_*, A10-A14)")
     
-    all_stops = [l.strip().upper() for l in lotes_input.split(',') if l.strip()]
-    valid_stops = [l for l in all_stops if l in COORDENADAS_LOTES]
-    invalid_stops = [l for l in all_stops if l not in COORDENADAS_LOTES]
+    valid_stops, invalid_stops = parse_lotes_input(lotes_input)
+    valid_stops = list(valid_stops)
 
     # --- SECCIÓN DE MÉTRICAS (MODIFICADA) ---
     c1, c2 = st.columns(2)
@@ -228,52 +298,146 @@ if page == "Planificación Operativa":
     
     # Advertencia detallada solo si hay errores
     if invalid_stops:
-        st.warning(f"⚠️ **Atención:** El sistema no reconoce estos códigos: {', '.join(invalid_stops)}")
+        st.warning(f"⚠️ **Atención:** El sistema no reconoce estos códigos (o el patrón supera {MAX_LOTES_POR_PATRON} lotes): {', '.join(invalid_stops)}")
 
     if valid_stops:
         with st.expander("🗺️ Ver Mapa de Lotes", expanded=False):
-            map_data = [{'lat': COORDENADAS_ORIGEN[1], 'lon': COORDENADAS_ORIGEN[0], 'name': 'INGENIO', 'color':'#000000'}]
-            for l in valid_stops:
-                coords = COORDENADAS_LOTES[l]
-                map_data.append({'lat': coords[1], 'lon': coords[0], 'name': l, 'color':'#0044ff'})
-            st.map(pd.DataFrame(map_data), size=20, color='color')
+            st.map(build_map_frame(tuple(valid_stops)), size=20, color='color')
 
     st.markdown("---")
     
-    col_btn, _ = st.columns([1, 3])
+    col_btn, col_stop, col_limit, col_trips = st.columns([1, 1, 1, 1])
     with col_btn:
         calculate = st.button("Calcular optimización", type="primary", disabled=len(valid_stops)==0, use_container_width=True)
+    with col_stop:
+        # Al pulsarlo se interrumpe la búsqueda en curso y se usa la mejor división guardada
+        accept_partial = st.button("Detener y aceptar actual", key="aceptar_parcial", type="secondary", disabled=len(valid_stops)==0, use_container_width=True)
+    with col_limit:
+        time_limit = st.number_input("Tiempo máx. búsqueda (s)", min_value=1, value=30, step=5, help="La búsqueda exhaustiva crece exponencialmente con la cantidad de lotes; al agotar el tiempo se usa la mejor división encontrada")
+    with col_trips:
+        multi_trip = st.checkbox("Planificar viajes múltiples", help="Divide la jornada de cada camión en viajes según capacidad, ventanas horarias y tiempos de servicio")
+
+    datos_viajes = None
+    if multi_trip and valid_stops:
+        with st.expander("📋 Datos de la jornada (capacidad, cargas y ventanas horarias)", expanded=True):
+            cap1, cap2, hora1, hora2 = st.columns(4)
+            capacidades = {
+                patente: col.number_input(f"Capacidad {patente} (t)", min_value=1.0, step=1.0,
+                                          value=float(VEHICLES[patente].get('capacidad', CAPACIDAD_POR_DEFECTO)))
+                for col, patente in zip((cap1, cap2), VEHICLES)
+            }
+            hora_inicio = hora1.time_input("Inicio de jornada", value=minutes_to_time(HORA_INICIO_JORNADA))
+            hora_fin = hora2.time_input("Fin de jornada", value=minutes_to_time(HORA_FIN_JORNADA))
+
+            tabla_lotes = pd.DataFrame({
+                "Lote": valid_stops,
+                "Carga (t)": [CARGA_LOTES.get(l) for l in valid_stops],
+                "Servicio (min)": [TIEMPO_SERVICIO_LOTES.get(l) for l in valid_stops],
+                "Ventana desde": [minutes_to_time(VENTANAS_LOTES[l][0]) if l in VENTANAS_LOTES else None for l in valid_stops],
+                "Ventana hasta": [minutes_to_time(VENTANAS_LOTES[l][1]) if l in VENTANAS_LOTES else None for l in valid_stops],
+            })
+            tabla_lotes = st.data_editor(
+                tabla_lotes, key="datos_lotes_editor", hide_index=True, use_container_width=True, disabled=["Lote"],
+                column_config={
+                    "Carga (t)": st.column_config.NumberColumn(min_value=0.0),
+                    "Servicio (min)": st.column_config.NumberColumn(min_value=0, step=1),
+                    "Ventana desde": st.column_config.TimeColumn(format="HH:mm"),
+                    "Ventana hasta": st.column_config.TimeColumn(format="HH:mm"),
+                }
+            )
+            st.caption(
+                f"Celdas vacías: carga {CARGA_POR_DEFECTO} t y servicio {TIEMPO_SERVICIO_POR_DEFECTO} min por defecto "
+                "(el resultado se marca como estimado); sin ventana, el lote admite toda la jornada, y con un solo "
+                "extremo informado el otro es el inicio o fin de la jornada."
+            )
+
+        inicio_jornada, fin_jornada = time_to_minutes(hora_inicio), time_to_minutes(hora_fin)
+        datos_lotes = {}
+        for fila in tabla_lotes.to_dict('records'):
+            desde, hasta = time_to_minutes(fila["Ventana desde"]), time_to_minutes(fila["Ventana hasta"])
+            ventana = None
+            if desde is not None or hasta is not None:
+                # Un solo extremo informado: el otro es el inicio/fin de la jornada
+                ventana = (inicio_jornada if desde is None else desde, fin_jornada if hasta is None else hasta)
+            datos_lotes[fila["Lote"]] = {
+                "carga": fila["Carga (t)"] if pd.notna(fila["Carga (t)"]) else None,
+                "servicio": fila["Servicio (min)"] if pd.notna(fila["Servicio (min)"]) else None,
+                "ventana": ventana,
+            }
+        datos_viajes = {
+            "lotes": datos_lotes,
+            "capacidades": capacidades,
+            "hora_inicio": inicio_jornada,
+            "hora_fin": fin_jornada,
+        }
+
+    def register_results(results):
+        st.session_state.results = results
+        if "error" in results:
+            return
+        now = datetime.now(ARG_TZ)
+        ra = results.get('ruta_a', {})
+        rb = results.get('ruta_b', {})
+        
+        km_a = km_ruta(ra)
+        km_b = km_ruta(rb)
+        
+        new_entry = {
+            "Fecha": now.strftime("%Y-%m-%d"),
+            "Hora": now.strftime("%H:%M:%S"),
+            "LotesIngresados": ", ".join(valid_stops),
+            "Lotes_CamionA": str(lotes_ruta(ra)),
+            "Lotes_CamionB": str(lotes_ruta(rb)),
+            "Km_CamionA": km_a,
+            "Km_CamionB": km_b,
+            "Km Totales": km_a + km_b,
+            # Con viajes, los km salen de la tabla de tiempos (línea recta × factor), no de GraphHopper
+            "Km_Estimados": "Sí" if ra.get('jornada') or rb.get('jornada') else "No"
+        }
+        save_new_route_to_sheet(new_entry)
+        st.session_state.historial_rutas.append(new_entry)
+        st.success("Planificación completada y guardada.")
 
     if calculate:
-        with st.spinner("Calculando distribución óptima de carga..."):
+        progress_bar = st.progress(0.0, text="Buscando la mejor división de lotes...")
+        progress_info = st.empty()
+
+        def on_progress(parcial):
+            st.session_state.mejor_parcial = dict(parcial, lotes=valid_stops)
+            # El total exhaustivo crece como 2^N; el avance se mide contra el tiempo máximo
+            fraccion = 1.0 if parcial['completado'] else parcial['tiempo_s'] / time_limit
+            progress_bar.progress(
+                min(fraccion, 1.0),
+                text=f"Búsqueda: {parcial['tiempo_s']:.0f} s de {time_limit} s · {parcial['evaluadas']:,} combinaciones evaluadas"
+            )
+            if parcial['grupo_a'] is not None:
+                progress_info.info(
+                    f"Mejor agrupación actual: **{parcial['distancia_km']} km** "
+                    f"(Camión 1: {len(parcial['grupo_a'])} lotes · Camión 2: {len(parcial['grupo_b'])} lotes) "
+                    f"· {parcial['tiempo_s']} s"
+                )
+            return False
+
+        with st.spinner("Calculando rutas de los vehículos..."):
             try:
-                results = solve_route_optimization(valid_stops)
-                st.session_state.results = results
-
-                if "error" not in results:
-                    now = datetime.now(ARG_TZ)
-                    ra = results.get('ruta_a', {})
-                    rb = results.get('ruta_b', {})
-                    
-                    km_a = ra.get('distancia_km', 0)
-                    km_b = rb.get('distancia_km', 0)
-                    
-                    new_entry = {
-                        "Fecha": now.strftime("%Y-%m-%d"),
-                        "Hora": now.strftime("%H:%M:%S"),
-                        "LotesIngresados": ", ".join(valid_stops),
-                        "Lotes_CamionA": str(ra.get('lotes_asignados', [])),
-                        "Lotes_CamionB": str(rb.get('lotes_asignados', [])),
-                        "Km_CamionA": km_a,
-                        "Km_CamionB": km_b,
-                        "Km Totales": km_a + km_b
-                    }
-                    save_new_route_to_sheet(new_entry)
-                    st.session_state.historial_rutas.append(new_entry)
-                    st.success("Planificación completada y guardada.")
+                results = solve_route_optimization(valid_stops, on_progress=on_progress, time_limit_s=time_limit, planificar_viajes=multi_trip, datos_viajes=datos_viajes)
+                st.session_state.mejor_parcial = None
+                register_results(results)
             except Exception as e:
                 st.error(f"Error crítico: {e}")
 
+    elif accept_partial:
+        parcial = st.session_state.mejor_parcial
+        st.session_state.mejor_parcial = None
+        if not parcial or parcial.get('lotes') != valid_stops:
+            st.warning("No hay una búsqueda en curso para estos lotes.")
+        else:
+            with st.spinner("Calculando rutas con la mejor división encontrada..."):
+                try:
+                    register_results(solve_routes_for_grouping(parcial['grupo_a'], parcial['grupo_b'], parcial['distancia_km'], multi_trip, datos_viajes))
+                except Exception as e:
+                    st.error(f"Error crítico: {e}")
+
     if st.session_state.results:
         res = st.session_state.results
         if "error" in res:
@@ -290,6 +454,8 @@ if page == "Planificación Operativa":
                     
                     if ra.get('mensaje'):
                         st.info("Sin asignación de lotes.")
+                    elif ra.get('jornada'):
+                        render_jornada(ra)
                     else:
                         kpi1, kpi2 = st.columns(2)
                         kpi1.metric("Distancia", f"{ra.get('distancia_km',0)} km")
@@ -313,6 +479,8 @@ if page == "Planificación Operativa":
                     
                     if rb.get('mensaje'):
                         st.info("Sin asignación de lotes.")
+                    elif rb.get('jornada'):
+                        render_jornada(rb)
                     else:
                         kpi1, kpi2 = st.columns(2)
                         kpi1.metric("Distancia", f"{rb.get('distancia_km',0)} km")
@@ -343,6 +511,7 @@ elif page == "Historial":
                 "Km_CamionA": st.column_config.NumberColumn("Km Unidad A", format="%.2f"),
                 "Km_CamionB": st.column_config.NumberColumn("Km Unidad B", format="%.2f"),
                 "Km Totales": st.column_config.NumberColumn("Km Totales", format="%.2f"),
+                "Km_Estimados": st.column_config.TextColumn("Km estimados (viajes)", help="Sí: km de la planificación por viajes (línea recta × factor), no km por camino de GraphHopper"),
             }
         )
     else:
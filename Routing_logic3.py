@@ -1,8 +1,11 @@
 import requests
 import json
 from urllib.parse import quote
-from math import radians, sin, cos, sqrt, atan2
+from math import radians, sin, cos, sqrt, atan2, comb
 from itertools import combinations
+from functools import lru_cache
+from bisect import bisect_left
+import re
 import time
 
 # =============================================================================
@@ -14,10 +17,23 @@ URL_ROUTE = f"https://graphhopper.com/api/1/route?key={API_KEY}"
 HEADERS = {'Content-Type': 'application/json'}
 COORDENADAS_ORIGEN = [-64.245138888888889, -23.260327777777778]
 VEHICLES = {
-"AF820AB": {"name": "Camión 1 (Ruta A)"},
-"AE898TW": {"name": "Camión 2 (Ruta B)"},
+"AF820AB": {"name": "Camión 1 (Ruta A)", "capacidad": 30},
+"AE898TW": {"name": "Camión 2 (Ruta B)", "capacidad": 30},
 }
 
+# Parámetros de planificación de viajes múltiples (tiempos en minutos desde las 00:00, cargas en toneladas)
+HORA_INICIO_JORNADA = 6 * 60
+HORA_FIN_JORNADA = 22 * 60
+VELOCIDAD_MEDIA_KMH = 30
+FACTOR_RECORRIDO = 1.3  # Distancia por camino / distancia en línea recta
+CAPACIDAD_POR_DEFECTO = 30
+CARGA_POR_DEFECTO = 10
+TIEMPO_SERVICIO_POR_DEFECTO = 20
+TIEMPO_DESCARGA_INGENIO = 30
+CARGA_LOTES = {}            # {"A05": 12, ...}
+TIEMPO_SERVICIO_LOTES = {}  # {"A05": 25, ...}
+VENTANAS_LOTES = {}         # {"A05": (8 * 60, 12 * 60), ...}
+
 # Diccionario de coordenadas (Completo)
 COORDENADAS_LOTES = {
 "A01_1": [-64.254233333333332, -23.255027777777777], "A01_2": [-64.26275833333334, -23.24804166666667], "A05": [-64.25640277777778, -23.247030555555558],
@@ -156,6 +172,15 @@ COORDENADAS_LOTES = {
 }
 COORDENADAS_LOTES_REVERSO = {tuple(v): k for k, v in COORDENADAS_LOTES.items()}
 
+# Índices del catálogo: orden lexicográfico (prefijos) y orden natural (rangos)
+def natural_key(nombre):
+    return [int(p) if p.isdigit() else p for p in re.split(r'(\d+)', nombre)]
+
+LOTES_ORDEN_LEXICO = sorted(COORDENADAS_LOTES)
+LOTES_ORDEN_NATURAL = sorted(COORDENADAS_LOTES, key=natural_key)
+POSICION_NATURAL = {nombre: i for i, nombre in enumerate(LOTES_ORDEN_NATURAL)}
+MAX_LOTES_POR_PATRON = 60  # Un prefijo o rango que agrega más lotes se considera inválido
+
 # =============================================================================
 # 2. FUNCIONES AUXILIARES (DEBE TENER SANGRÍA INTERNA)
 # =============================================================================
@@ -172,40 +197,134 @@ def haversine(coord1, coord2):
     distance = R * c
     return distance
 
-def find_best_grouping_variable(all_lotes, min_group_size=1):
+def expand_lote_token(token):
+    """Expande un código ingresado: exacto ("A05"), prefijo ("A09_*") o rango ("A09_1-A09_4").
+    Devuelve None si no coincide con el catálogo, si el prefijo está vacío o si
+    el patrón supera MAX_LOTES_POR_PATRON lotes."""
+    if token in COORDENADAS_LOTES:
+        return [token]
+    if token.endswith('*'):
+        prefijo = token[:-1].strip()
+        if not prefijo:
+            return None
+        i = bisect_left(LOTES_ORDEN_LEXICO, prefijo)
+        encontrados = []
+        while i < len(LOTES_ORDEN_LEXICO) and LOTES_ORDEN_LEXICO[i].startswith(prefijo):
+            encontrados.append(LOTES_ORDEN_LEXICO[i])
+            i += 1
+        if not encontrados or len(encontrados) > MAX_LOTES_POR_PATRON:
+            return None
+        return sorted(encontrados, key=natural_key)
+    # Rango: se prueba cada guion, ya que los extremos pueden contener guiones ("TU-DR01")
+    for corte in (m.start() for m in re.finditer('-', token)):
+        desde, hasta = token[:corte].strip(), token[corte + 1:].strip()
+        if desde in POSICION_NATURAL and hasta in POSICION_NATURAL:
+            i, j = sorted((POSICION_NATURAL[desde], POSICION_NATURAL[hasta]))
+            if j - i + 1 <= MAX_LOTES_POR_PATRON:
+                return LOTES_ORDEN_NATURAL[i:j + 1]
+    return None
+
+@lru_cache(maxsize=256)
+def parse_lotes_input(texto):
+    """Convierte el texto ingresado en (lotes_validos, codigos_invalidos), sin duplicados."""
+    validos, invalidos = {}, {}
+    for token in texto.upper().split(','):
+        token = token.strip()
+        if not token:
+            continue
+        lotes = expand_lote_token(token)
+        if lotes is None:
+            invalidos[token] = None
+        else:
+            validos.update(dict.fromkeys(lotes))
+    return tuple(validos), tuple(invalidos)
+
+def calculate_internal_distance(group):
+    dist = 0
+    L = len(group)
+    if L < 2:
+        return 0
+    for i in range(L):
+        for j in range(i + 1, L):
+            coord1 = COORDENADAS_LOTES[group[i]]
+            coord2 = COORDENADAS_LOTES[group[j]]
+            dist += haversine(coord1, coord2)
+    return dist
+
+def iter_best_grouping(all_lotes, min_group_size=1, time_limit_s=None, report_every_s=0.5):
+    """Generador 'anytime': produce la mejor división encontrada hasta el momento.
+
+    Emite un resultado cada vez que mejora el objetivo y, como mínimo, cada
+    `report_every_s` segundos. Si se alcanza `time_limit_s` la búsqueda se corta
+    y el último resultado emitido es el mejor disponible.
+
+    El primer resultado es una división equilibrada por longitud; luego se
+    recorren los tamaños desde N//2 hacia abajo (los tamaños mayores son las
+    mismas divisiones con los grupos intercambiados).
+    """
+    start = time.time()
+    last_report = start
     min_total_internal_distance = float('inf')
     best_group_a = None
     best_group_b = None
     all_lotes_set = set(all_lotes)
     N = len(all_lotes)
-    for size_a in range(min_group_size, N - min_group_size + 1):
-        for group_a_tuple in combinations(all_lotes, size_a):
-            group_a = list(group_a_tuple)
-            group_b = list(all_lotes_set - set(group_a))
-            
-            # Función anidada para calcular distancia interna (indenta correctamente)
-            def calculate_internal_distance(group):
-                dist = 0
-                L = len(group)
-                if L < 2:
-                    return 0
-                for i in range(L):
-                    for j in range(i + 1, L):
-                        lote1 = group[i]
-                        lote2 = group[j]
-                        coord1 = COORDENADAS_LOTES[lote1]
-                        coord2 = COORDENADAS_LOTES[lote2]
-                        dist += haversine(coord1, coord2)
-                return dist
-                
-            dist_a = calculate_internal_distance(group_a)
-            dist_b = calculate_internal_distance(group_b)
-            current_total_distance = dist_a + dist_b
-            if current_total_distance < min_total_internal_distance:
-                min_total_internal_distance = current_total_distance
-                best_group_a = group_a
-                best_group_b = group_b
-    return best_group_a, best_group_b, round(min_total_internal_distance / 1000, 2)
+    mitad = N // 2
+    usa_heuristica = mitad >= min_group_size
+    total = int(usa_heuristica) + sum(comb(N, k) for k in range(min_group_size, mitad + 1))
+    if usa_heuristica and 2 * mitad == N:
+        total -= comb(N, mitad) // 2
+    evaluadas = 0
+
+    def candidatos():
+        if usa_heuristica:
+            por_longitud = sorted(all_lotes, key=lambda l: COORDENADAS_LOTES[l][0])
+            yield por_longitud[:mitad]
+        for size_a in range(mitad, min_group_size - 1, -1):
+            if 2 * size_a == N:
+                # Con grupos iguales, fijar el primer lote en A evita evaluar cada división dos veces
+                for resto in combinations(all_lotes[1:], size_a - 1):
+                    yield [all_lotes[0]] + list(resto)
+            else:
+                for group_a_tuple in combinations(all_lotes, size_a):
+                    yield list(group_a_tuple)
+
+    def snapshot(mejora, completado=False):
+        return {
+            "grupo_a": best_group_a,
+            "grupo_b": best_group_b,
+            "distancia_km": round(min_total_internal_distance / 1000, 2),
+            "tiempo_s": round(time.time() - start, 2),
+            "evaluadas": evaluadas,
+            "total": total,
+            "mejora": mejora,
+            "completado": completado,
+        }
+
+    for group_a in candidatos():
+        group_b = list(all_lotes_set - set(group_a))
+        evaluadas += 1
+        current_total_distance = calculate_internal_distance(group_a) + calculate_internal_distance(group_b)
+        now = time.time()
+        if current_total_distance < min_total_internal_distance:
+            min_total_internal_distance = current_total_distance
+            best_group_a = group_a
+            best_group_b = group_b
+            last_report = now
+            yield snapshot(True)
+        elif now - last_report >= report_every_s:
+            last_report = now
+            yield snapshot(False)
+        if time_limit_s is not None and now - start >= time_limit_s:
+            yield snapshot(False, completado=True)
+            return
+    yield snapshot(False, completado=True)
+
+def find_best_grouping_variable(all_lotes, min_group_size=1):
+    best = None
+    for best in iter_best_grouping(all_lotes, min_group_size):
+        pass
+    return best["grupo_a"], best["grupo_b"], best["distancia_km"]
 
 def make_api_request(points_list):
     URL_ROUTE_FINAL = f"https://graphhopper.com/api/1/route?key={API_KEY}"
@@ -284,11 +403,179 @@ def generate_geojson_io_link(geojson_object):
     return base_url + encoded_geojson
 
 # =============================================================================
-# 3. FUNCIÓN PRINCIPAL EXPORTABLE (solve_route_optimization)
+# 3. PLANIFICACIÓN DE VIAJES MÚLTIPLES (CAPACIDAD Y VENTANAS HORARIAS)
+# =============================================================================
+
+def minutes_to_hhmm(minutes):
+    minutes = int(round(minutes))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def build_time_table(lotes):
+    """Tabla de tiempos de viaje (minutos) precalculada. Índice 0 = Ingenio."""
+    coords = [COORDENADAS_ORIGEN] + [COORDENADAS_LOTES[l] for l in lotes]
+    metros_a_minutos = FACTOR_RECORRIDO / (VELOCIDAD_MEDIA_KMH * 1000 / 60)
+    n = len(coords)
+    tabla = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            tabla[i][j] = tabla[j][i] = haversine(coords[i], coords[j]) * metros_a_minutos
+    return tabla
+
+def compute_schedule(seq, tabla, inicio, fin, servicio):
+    """Horarios de inicio y holgura hacia adelante (forward slack) de la secuencia.
+
+    `seq` es la jornada completa del camión: nodos de lotes separados por visitas
+    al Ingenio (0). La holgura de la posición k es cuánto puede retrasarse su
+    inicio sin violar ninguna ventana posterior, lo que permite evaluar cada
+    inserción en O(1).
+    """
+    n = len(seq)
+    begin = [0.0] * n
+    wait = [0.0] * n
+    begin[0] = inicio[seq[0]]
+    for k in range(1, n):
+        llegada = begin[k - 1] + (servicio[seq[k - 1]] if k > 1 else 0) + tabla[seq[k - 1]][seq[k]]
+        begin[k] = max(llegada, inicio[seq[k]])
+        wait[k] = begin[k] - llegada
+    slack = [0.0] * n
+    slack[-1] = fin[seq[-1]] - begin[-1]
+    for k in range(n - 2, -1, -1):
+        slack[k] = min(fin[seq[k]] - begin[k], wait[k + 1] + slack[k + 1])
+    return begin, slack
+
+def schedule_vehicle_trips(lotes, vehicle_id, hora_inicio=None, hora_fin=None, datos_lotes=None, capacidad=None):
+    """Divide los lotes de un camión en varios viajes Ingenio→lotes→Ingenio.
+
+    Inserción más barata respetando la capacidad del camión, las ventanas
+    horarias y los tiempos de servicio de cada lote. La factibilidad de cada
+    inserción se comprueba con la holgura precalculada, por lo que el costo total
+    es O(n²) y escala a cientos de lotes por día.
+
+    `datos_lotes` ({lote: {"carga", "servicio", "ventana"}}) tiene prioridad sobre
+    CARGA_LOTES / TIEMPO_SERVICIO_LOTES / VENTANAS_LOTES. Los lotes sin carga o
+    tiempo de servicio informados usan los valores por defecto y se listan en
+    `lotes_estimados`.
+    """
+    hora_inicio = HORA_INICIO_JORNADA if hora_inicio is None else hora_inicio
+    hora_fin = HORA_FIN_JORNADA if hora_fin is None else hora_fin
+    if capacidad is None:
+        capacidad = VEHICLES[vehicle_id].get('capacidad', CAPACIDAD_POR_DEFECTO)
+    datos_lotes = datos_lotes or {}
+
+    def dato(lote, clave, tabla_modulo):
+        valor = datos_lotes.get(lote, {}).get(clave)
+        return tabla_modulo.get(lote) if valor is None else valor
+
+    tabla = build_time_table(lotes)
+    nodos = ["Ingenio"] + list(lotes)
+    carga = [0.0]
+    servicio = [TIEMPO_DESCARGA_INGENIO]
+    inicio = [hora_inicio]
+    # La última llegada al Ingenio debe dejar tiempo para descargar antes del cierre
+    fin = [hora_fin - TIEMPO_DESCARGA_INGENIO]
+    lotes_estimados = []
+    for l in lotes:
+        c, s = dato(l, "carga", CARGA_LOTES), dato(l, "servicio", TIEMPO_SERVICIO_LOTES)
+        if c is None or s is None:
+            lotes_estimados.append(l)
+        ventana = dato(l, "ventana", VENTANAS_LOTES) or (hora_inicio, hora_fin)
+        carga.append(CARGA_POR_DEFECTO if c is None else c)
+        servicio.append(TIEMPO_SERVICIO_POR_DEFECTO if s is None else s)
+        inicio.append(ventana[0])
+        fin.append(ventana[1])
+
+    # Primero los lotes con ventana más temprana y, a igualdad, los más lejanos
+    pendientes = sorted(range(1, len(nodos)), key=lambda u: (fin[u], -tabla[0][u]))
+    no_asignados = [nodos[u] for u in pendientes if carga[u] > capacidad]
+    pendientes = [u for u in pendientes if carga[u] <= capacidad]
+
+    seq = [0, 0]
+    cargas_viaje = [0.0]
+    begin, slack = compute_schedule(seq, tabla, inicio, fin, servicio)
+    for u in pendientes:
+        mejor_costo, mejor_pos = float('inf'), None
+        viaje = 0
+        for k in range(len(seq) - 1):
+            if k > 0 and seq[k] == 0:
+                viaje += 1
+            if cargas_viaje[viaje] + carga[u] > capacidad:
+                continue
+            i, j = seq[k], seq[k + 1]
+            llegada_u = begin[k] + (servicio[i] if k > 0 else 0) + tabla[i][u]
+            if llegada_u > fin[u]:
+                continue
+            inicio_j = max(max(llegada_u, inicio[u]) + servicio[u] + tabla[u][j], inicio[j])
+            if inicio_j - begin[k + 1] > slack[k + 1]:
+                continue
+            costo = tabla[i][u] + tabla[u][j] - tabla[i][j]
+            if costo < mejor_costo:
+                mejor_costo, mejor_pos = costo, (k + 1, viaje)
+
+        if mejor_pos is None:
+            # Nuevo viaje al final de la jornada
+            k = len(seq) - 1
+            llegada_u = begin[k] + servicio[0] + tabla[0][u]
+            inicio_u = max(llegada_u, inicio[u])
+            if llegada_u <= fin[u] and inicio_u + servicio[u] + tabla[u][0] <= fin[0]:
+                seq.extend([u, 0])
+                cargas_viaje.append(carga[u])
+            else:
+                no_asignados.append(nodos[u])
+                continue
+        else:
+            pos, viaje = mejor_pos
+            seq.insert(pos, u)
+            cargas_viaje[viaje] += carga[u]
+        begin, slack = compute_schedule(seq, tabla, inicio, fin, servicio)
+
+    viajes = []
+    minutos_viaje = 0.0
+    actual = None
+    for k, nodo in enumerate(seq):
+        if k > 0:
+            minutos_viaje += tabla[seq[k - 1]][nodo]
+        if nodo == 0:
+            if actual and actual["lotes"]:
+                actual["regreso"] = minutes_to_hhmm(begin[k])
+                viajes.append(actual)
+            actual = {"numero": len(viajes) + 1, "lotes": [], "llegadas": [], "carga": 0.0,
+                      "salida": minutes_to_hhmm(begin[k] + (servicio[0] if k > 0 else 0))}
+        else:
+            actual["lotes"].append(nodos[nodo])
+            actual["llegadas"].append(minutes_to_hhmm(begin[k]))
+            actual["carga"] += carga[nodo]
+
+    return {
+        "patente": vehicle_id,
+        "capacidad": capacidad,
+        "viajes": viajes,
+        "no_asignados": no_asignados,
+        "distancia_estimada_km": round(minutos_viaje * VELOCIDAD_MEDIA_KMH / 60, 2),
+        "fin_jornada": minutes_to_hhmm(begin[-1] + TIEMPO_DESCARGA_INGENIO) if viajes else None,
+        "lotes_estimados": lotes_estimados,
+    }
+
+# =============================================================================
+# 4. FUNCIÓN PRINCIPAL EXPORTABLE (solve_route_optimization)
 # =============================================================================
 
-def solve_route_optimization(all_intermediate_stops):
-    group_a_names, group_b_names, min_internal_dist = find_best_grouping_variable(all_intermediate_stops)
+def solve_route_optimization(all_intermediate_stops, on_progress=None, time_limit_s=None, planificar_viajes=False, datos_viajes=None):
+    """Agrupa los lotes en dos camiones y calcula las rutas.
+
+    `on_progress(parcial)` recibe cada resultado de `iter_best_grouping`; si
+    devuelve True la búsqueda se detiene y se acepta la mejor división actual.
+    `time_limit_s` limita el tiempo de la búsqueda de agrupación.
+    Con `planificar_viajes` cada ruta incluye su división en viajes (ver
+    `schedule_vehicle_trips`); `datos_viajes` admite las claves "lotes",
+    "capacidades" ({patente: t}), "hora_inicio" y "hora_fin".
+    """
+    best = None
+    for best in iter_best_grouping(all_intermediate_stops, time_limit_s=time_limit_s):
+        if on_progress and on_progress(best):
+            break
+    return solve_routes_for_grouping(best["grupo_a"], best["grupo_b"], best["distancia_km"], planificar_viajes, datos_viajes)
+
+def solve_routes_for_grouping(group_a_names, group_b_names, min_internal_dist, planificar_viajes=False, datos_viajes=None):
     if not group_a_names or not group_b_names:
         return {"error": "No se pudo realizar la agrupación de lotes."}
     VEHICLE_A_ID = "AF820AB"
@@ -336,4 +623,13 @@ def solve_route_optimization(all_intermediate_stops):
     else:
         return {"error": "Fallo al obtener la Ruta B de la API. (Verifique API Key o límites)"}
 
+    if planificar_viajes:
+        datos = datos_viajes or {}
+        capacidades = datos.get("capacidades", {})
+        for clave, nombres, vehicle_id in (("ruta_a", group_a_names, VEHICLE_A_ID), ("ruta_b", group_b_names, VEHICLE_B_ID)):
+            results[clave]["jornada"] = schedule_vehicle_trips(
+                nombres, vehicle_id, datos.get("hora_inicio"), datos.get("hora_fin"),
+                datos.get("lotes"), capacidades.get(vehicle_id)
+            )
+
     return results